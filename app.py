@@ -3,22 +3,48 @@
 #!/usr/bin/env python3
 import os
 import re
+import math
+import calendar
 import datetime
-import pandas as pd
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 from database_manager import DatabaseManager
 from pdf_parser import PDFParser
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+SELECT_DEBOUNCE_MS = 150
+# Resúmenes cuyas filas quedan desacopladas en el árbol; el menos usado se descarta
+TXN_POOL_MAX = 8
+PARQUET_BATCH_ROWS = 50_000
+_FNAME_RE = re.compile(r"(\d{4})[ -_]?(\d{2})")
+# Paleta tab10 (la de matplotlib por defecto)
+PIE_COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+              '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
 
 class ExpenseApp:
     def __init__(self) -> None:
         self.db = DatabaseManager()
         self.cash_id = self.db.get_cash_statement_id()
         self.parser = PDFParser()
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        self._worker_db = threading.local()
+        self._worker_dbs = []
+        self._worker_dbs_lock = threading.Lock()
+        self._txn_stores = {}
+        self._iid_to_tid = {}
+        self._store_categories = {}
+        self._txn_pool = {}
+        self._sums_cache = {}
+        self._statements_by_id = {}
+        self._iid_to_sid = {}
+        self._tree_rows = weakref.WeakKeyDictionary()
+        self._categories = None
+        self._last_chart_key = None
+        self._pending_select = None
+        self._pending_refresh = None
+        self._pie_data = None
 
         self.root = tk.Tk()
         self.root.title("Gestor de Gastos de Tarjetas")
@@ -39,11 +65,12 @@ class ExpenseApp:
     def _build_top_controls(self, parent):
         top = ttk.Frame(parent)
         top.grid(row=0, column=0, sticky='ew', pady=5, padx=5)
-        for i in range(9):
+        for i in range(10):
             top.columnconfigure(i, weight=0)
         top.columnconfigure(8, weight=1)
 
-        ttk.Button(top, text="Cargar Resumen",     command=self.load_statement).grid(row=0, column=0, padx=5)
+        self.btn_load = ttk.Button(top, text="Cargar Resumen", command=self.load_statement)
+        self.btn_load.grid(row=0, column=0, padx=5)
         ttk.Button(top, text="Gestionar Categorías", command=self.manage_categories).grid(row=0, column=1, padx=5)
         ttk.Button(top, text="Modificar Resumen",  command=self.modify_statement_ui).grid(row=0, column=2, padx=5)
         ttk.Button(top, text="Eliminar Resumen",   command=self.delete_statement).grid(row=0, column=3, padx=5)
@@ -53,6 +80,10 @@ class ExpenseApp:
         self.show_all_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(top, text="Todos períodos", variable=self.show_all_var, command=self.on_toggle_mode).grid(row=0, column=7, padx=5)
         ttk.Label(top, text="Seleccione un resumen para ver detalles").grid(row=0, column=8, padx=10, sticky='w')
+        # Visible sólo mientras se importa un PDF
+        self.progress = ttk.Progressbar(top, mode='indeterminate', length=120)
+        self.progress.grid(row=0, column=9, padx=5)
+        self.progress.grid_remove()
 
     def _build_statement_list(self, parent):
         f = ttk.Frame(parent)
@@ -82,10 +113,10 @@ class ExpenseApp:
         sb2 = ttk.Scrollbar(f, orient='vertical', command=self.tree_transactions.yview)
         self.tree_transactions.configure(yscroll=sb2.set); sb2.grid(row=0, column=1, sticky='ns')
 
-        self.figure = plt.Figure(figsize=(6,6))
-        self.ax = self.figure.add_subplot(111)
-        self.canvas = FigureCanvasTkAgg(self.figure, master=f)
-        self.canvas.get_tk_widget().grid(row=0, column=2, sticky='nsew', padx=10)
+        # Torta dibujada directo en un Canvas: unos pocos ítems por porción
+        self.pie_canvas = tk.Canvas(f, width=400, height=400, highlightthickness=0)
+        self.pie_canvas.grid(row=0, column=2, sticky='nsew', padx=10)
+        self.pie_canvas.bind('<Configure>', lambda e: self._draw_pie())
 
         sf = ttk.Frame(f)
         sf.grid(row=1, column=0, columnspan=3, sticky='ew', pady=5)
@@ -96,52 +127,176 @@ class ExpenseApp:
         self.lbl_cat_tot = ttk.Label(sf, text='', justify='left', font=(None,12))
         self.lbl_cat_tot.grid(row=0, column=1, sticky='w')
 
+    def _fill_tree(self, tree, rows):
+        # Se oculta el árbol mientras se repuebla para que Tk recalcule la geometría una sola vez
+        tree.grid_remove()
+        # Las filas que siguen existiendo se reutilizan: sólo se tocan los valores que
+        # cambiaron y un único set_children fija el orden y desprende las que sobran
+        shown = self._tree_rows.get(tree, {})
+        new = {}
+        insert, item = tree.insert, tree.item
+        for iid, values in rows:
+            old = shown.get(iid)
+            if old is None:
+                insert('', 'end', iid=iid, values=values)
+            elif old != values:
+                item(iid, values=values)
+            new[iid] = values
+        tree.set_children('', *new)
+        stale = [iid for iid in shown if iid not in new]
+        if stale:
+            tree.delete(*stale)
+        self._tree_rows[tree] = new
+        tree.grid()
+
     def refresh_statements(self) -> None:
-        for i in self.tree_statements.get_children():
-            self.tree_statements.delete(i)
-        for sid, m, y, cn, _ in self.db.get_statements():
-            self.tree_statements.insert('', 'end', iid=str(sid), values=(f"{m:02d}", y, cn))
+        statements = self.db.get_statements()
+        self._statements_by_id = {}
+        self._iid_to_sid = {}
+        rows = []
+        for r in statements:
+            sid = r['id']; iid = str(sid)
+            self._statements_by_id[sid] = r
+            self._iid_to_sid[iid] = sid
+            rows.append((iid, (f"{r['month']:02d}", r['year'], r['card_name'])))
+        self._fill_tree(self.tree_statements, rows)
+
+    def _schedule_refresh(self):
+        # Varias modificaciones seguidas se resuelven en un solo repoblado cuando Tk queda ocioso
+        if self._pending_refresh is None:
+            self._pending_refresh = self.root.after_idle(self._apply_refresh)
+
+    def _apply_refresh(self):
+        self._pending_refresh = None
+        self.refresh_statements()
 
     def on_statement_select(self, event):
+        # Se posterga la carga para que navegar con flechas no consulte/dibuje cada fila recorrida
+        if self._pending_select:
+            self.root.after_cancel(self._pending_select)
+            self._pending_select = None
         sel = self.tree_statements.selection()
         if sel:
-            self.display_transactions(int(sel[0]))
+            self._pending_select = self.root.after(SELECT_DEBOUNCE_MS, self._apply_statement_select, self._iid_to_sid[sel[0]])
+
+    def _apply_statement_select(self, sid: int):
+        self._pending_select = None
+        self.display_transactions(sid)
 
     def display_transactions(self, sid: int):
-        for i in self.tree_transactions.get_children():
-            self.tree_transactions.delete(i)
-        for tid, date_iso, store, amt, inst, sid2 in self.db.get_transactions_by_statement(sid):
-            cid, cname = self.db.get_store_category(sid2)
-            self.tree_transactions.insert('', 'end', iid=str(tid), values=(
-                datetime.datetime.fromisoformat(date_iso).strftime('%d/%m/%Y'),
-                store, f"{amt:,.2f}", inst or '', cname
-            ))
+        # Los ítems de cada resumen ya visitado quedan desacoplados en el árbol y se
+        # vuelven a enganchar al volver a él; _drop_txn_pool los descarta al modificarse
+        tree = self.tree_transactions
+        tree.grid_remove()
+        cached = self._txn_pool.get(sid)
+        if cached is None:
+            shown = tree.get_children()
+            if shown:
+                tree.detach(*shown)
+            iid_to_tid = {}; txn_stores = {}; store_categories = {}
+            insert = tree.insert
+            for r in self.db.get_transactions_by_statement(sid):
+                tid = r['id']; iid = str(tid)
+                iid_to_tid[iid] = tid
+                txn_stores[iid] = r['store_id']
+                store_categories[r['store_id']] = r['category_id']
+                insert('', 'end', iid=iid,
+                       values=(r['fecha'], r['store'], f"{r['amount']:,.2f}", r['installment'] or '', r['category']))
+            cached = self._txn_pool[sid] = (tuple(iid_to_tid), iid_to_tid, txn_stores, store_categories)
+            if len(self._txn_pool) > TXN_POOL_MAX:
+                # el primero del dict es el usado hace más tiempo (nunca el recién cargado)
+                old = self._txn_pool.pop(next(iter(self._txn_pool)))
+                if old[0]:
+                    tree.delete(*old[0])
+        else:
+            # Un solo set_children reengancha las filas en orden y desprende las del resumen anterior
+            tree.set_children('', *cached[0])
+            # al final del dict: queda como el más recientemente usado
+            self._txn_pool[sid] = self._txn_pool.pop(sid)
+        tree.grid()
+        _, self._iid_to_tid, self._txn_stores, self._store_categories = cached
         self.update_chart(sid)
 
-    def update_chart(self, sid: int):
-        self.ax.clear()
-        sums = self.db.get_all_category_sums() if self.show_all_var.get() else self.db.get_category_sums(sid)
-        positive = [(n, t) for n, t in sums if t>0 and n.upper()!='NO APLICA']
-        if positive:
-            labels, sizes = zip(*positive)
-            self.ax.pie(sizes,
-                        labels=labels,
-                        autopct='%1.1f%%',
-                        startangle=90,
-                        textprops={'fontsize':12})
-            self.ax.axis('equal')
-            self.ax.set_title('Gastos por Categoría', fontsize=18)
+    def _drop_txn_pool(self, sid=None):
+        # sid=None descarta todos los resúmenes (p. ej. al cambiar la categoría de un comercio).
+        # Las sumas del gráfico caen junto con las filas; la vista "todos" cambia siempre
+        if sid is None:
+            self._sums_cache.clear()
         else:
-            self.ax.text(0.5,0.5,'Sin datos', ha='center', va='center')
-        self.canvas.draw()
+            self._sums_cache.pop(sid, None); self._sums_cache.pop(None, None)
+        for s in (list(self._txn_pool) if sid is None else [sid]):
+            cached = self._txn_pool.pop(s, None)
+            if cached and cached[0]:
+                self.tree_transactions.delete(*cached[0])
+
+    def _set_store_category(self, store_id, cid, name):
+        # Sólo se reescribe la celda de categoría de las filas de ese comercio ya cargadas
+        tree = self.tree_transactions
+        for _, _, txn_stores, store_categories in self._txn_pool.values():
+            if store_id in store_categories:
+                store_categories[store_id] = cid
+                for iid, st in txn_stores.items():
+                    if st == store_id: tree.set(iid, 'categoria', name)
+        self._sums_cache.clear()
+
+    def update_chart(self, sid: int):
+        view = None if self.show_all_var.get() else sid
+        sums = self._sums_cache.get(view)
+        if sums is None:
+            sums = self._sums_cache[view] = tuple(self.db.get_category_breakdown(view))
+        key = (view, sums)
+        if key == self._last_chart_key:
+            return
+        self._last_chart_key = key
+
+        labels, sizes, lines = [], [], []
+        for n, t, _, charted in sums:
+            lines.append(f"{n}: $ {t:,.2f}")
+            if charted:
+                labels.append(n); sizes.append(t)
+
+        self._pie_data = (labels, sizes) if sizes else None
+        self._draw_pie()
 
-        total = sum(t for _,t in sums)
+        total = sums[0][2] if sums else 0
         self.lbl_total.config(text=f"Total: $ {total:,.2f}")
-        self.lbl_cat_tot.config(text='\n'.join(f"{n}: $ {t:,.2f}" for n, t in sums))
+        self.lbl_cat_tot.config(text='\n'.join(lines))
+
+    def _draw_pie(self):
+        c = self.pie_canvas
+        c.delete('pie')
+        w, h = c.winfo_width(), c.winfo_height()
+        if self._pie_data is None:
+            c.create_text(w / 2, h / 2, text='Sin datos', tags='pie')
+            return
+        labels, sizes = self._pie_data
+        c.create_text(w / 2, 20, text='Gastos por Categoría', font=('TkDefaultFont', 16), tags='pie')
+        # margen para las etiquetas que quedan fuera del círculo
+        r = max(min(w, h - 40) / 2 - 70, 10)
+        cx, cy = w / 2, (h + 40) / 2
+        bbox = (cx - r, cy - r, cx + r, cy + r)
+        total = sum(sizes)
+        start = 90.0
+        for i, (label, size) in enumerate(zip(labels, sizes)):
+            extent = 360.0 * size / total
+            color = PIE_COLORS[i % len(PIE_COLORS)]
+            if extent >= 359.99:
+                # create_arc no dibuja una porción de 360°
+                c.create_oval(*bbox, fill=color, outline='', tags='pie')
+            else:
+                c.create_arc(*bbox, start=start, extent=extent, fill=color, outline='', tags='pie')
+            mid = math.radians(start + extent / 2)
+            # el eje y del Canvas crece hacia abajo
+            x, y = math.cos(mid), -math.sin(mid)
+            c.create_text(cx + 1.1 * r * x, cy + 1.1 * r * y, text=label,
+                          anchor='w' if x > 0 else 'e', tags='pie')
+            c.create_text(cx + 0.6 * r * x, cy + 0.6 * r * y,
+                          text=f"{100 * size / total:1.1f}%", tags='pie')
+            start += extent
 
     def add_manual_transaction_ui(self):
         sel = self.tree_statements.selection()
-        if not sel or int(sel[0]) != self.cash_id:
+        if not sel or self._iid_to_sid[sel[0]] != self.cash_id:
             messagebox.showinfo('Añadir Gasto','Seleccione el período EFECTIVO.')
             return
         sid = self.cash_id
@@ -155,6 +310,7 @@ class ExpenseApp:
             messagebox.showerror('Error','Monto inválido')
             return
         self.db.add_manual_transaction(sid, date, store, amt)
+        self._drop_txn_pool(sid)
         self.display_transactions(sid)
         messagebox.showinfo('Añadir Gasto','Gasto agregado')
 
@@ -163,42 +319,41 @@ class ExpenseApp:
         if not sel:
             messagebox.showinfo('Eliminar Gasto','Seleccione un gasto')
             return
-        txn_id = int(sel[0])
+        txn_id = self._iid_to_tid.get(sel[0])
+        if txn_id is None: return
         if not messagebox.askyesno('Confirmar','¿Eliminar este gasto?'):
             return
-        self.db.conn.execute('DELETE FROM transactions WHERE id=?',(txn_id,))
-        self.db.conn.commit()
-        sel_stmt = self.tree_statements.selection()
-        if sel_stmt:
-            self.display_transactions(int(sel_stmt[0]))
+        self.db.delete_transaction(txn_id)
+        # Se descarta el resumen dueño del gasto, no el que esté seleccionado en la lista
+        sid = next((s for s, cached in self._txn_pool.items() if sel[0] in cached[1]), None)
+        if sid is None:
+            self._drop_txn_pool()
+        else:
+            self._drop_txn_pool(sid)
+            self.display_transactions(sid)
         messagebox.showinfo('Eliminar Gasto','Gasto eliminado')
 
     def on_transaction_double_click(self, event):
         item = self.tree_transactions.identify_row(event.y)
         if not item: return
-        txn_id = int(item)
-        cur = self.db.conn.cursor()
-        cur.execute('SELECT store_id FROM transactions WHERE id=?',(txn_id,))
-        row = cur.fetchone()
-        if not row: return
-        store_id = row[0]
-        cats = self.db.get_categories()
-        names = [n for _,n in cats]; ids = [i for i,_ in cats]
-        curr_id,_ = self.db.get_store_category(store_id)
+        store_id = self._txn_stores.get(item)
+        if store_id is None: return
+        _, names, ids, id_to_idx = self._get_categories()
+        curr_id = self._store_categories.get(store_id)
 
         dlg = tk.Toplevel(self.root)
         dlg.title('Asignar Categoría'); dlg.transient(self.root)
         ttk.Label(dlg, text='Seleccione categoría:').grid(row=0,column=0,padx=10,pady=10)
         combo = ttk.Combobox(dlg, values=names, state='readonly'); combo.grid(row=1,column=0,padx=10,pady=10)
-        try: combo.current(ids.index(curr_id))
-        except: pass
+        if curr_id in id_to_idx: combo.current(id_to_idx[curr_id])
 
         def on_ok():
             idx = combo.current()
             if idx>=0:
                 self.db.update_store_category(store_id, ids[idx])
+                self._set_store_category(store_id, ids[idx], names[idx])
                 sel = self.tree_statements.selection()
-                if sel: self.display_transactions(int(sel[0]))
+                if sel: self.update_chart(self._iid_to_sid[sel[0]])
             dlg.destroy()
 
         ttk.Button(dlg, text='Aceptar', command=on_ok).grid(row=2,column=0,padx=10,pady=10)
@@ -207,12 +362,20 @@ class ExpenseApp:
     def on_toggle_mode(self):
         self.on_statement_select(None)
 
+    def _get_categories(self):
+        # (filas, nombres, ids, id -> posición); se invalida al agregar o eliminar categorías
+        if self._categories is None:
+            cats = self.db.get_categories()
+            ids = tuple(i for i, _ in cats)
+            self._categories = (cats, tuple(n for _, n in cats), ids, {i: k for k, i in enumerate(ids)})
+        return self._categories
+
     def load_statement(self):
         file_path = filedialog.askopenfilename(filetypes=[('PDF files','*.pdf')])
         if not file_path: return
         filename = os.path.basename(file_path)
         default_month, default_year = datetime.date.today().month, datetime.date.today().year
-        m = re.search(r"(\d{4})[ -_]?(\d{2})", filename)
+        m = _FNAME_RE.search(filename)
         if m:
             default_year, default_month = int(m.group(1)), int(m.group(2))
 
@@ -229,44 +392,71 @@ class ExpenseApp:
             messagebox.showerror('Error','Mes o año inválido')
             return
 
+        self.btn_load.config(state='disabled')
+        self.progress.grid(); self.progress.start(15)
+        future = self._executor.submit(self._import_statement, file_path, month, year, cn.strip())
+        self._poll_load(future)
+
+    def _writer_db(self):
+        # Cada hilo de trabajo abre su propia conexión; con WAL la de Tk sigue leyendo.
+        # Se registran para cerrarlas desde run() una vez terminados los hilos
+        db = getattr(self._worker_db, 'db', None)
+        if db is None:
+            db = self._worker_db.db = DatabaseManager(self.db.db_path, check_same_thread=False)
+            with self._worker_dbs_lock:
+                self._worker_dbs.append(db)
+        return db
+
+    def _import_statement(self, file_path, month, year, card_name):
+        # Corre en un hilo de trabajo: no toca Tk ni self.db
+        adjusted = self.parser.parse_pdf(file_path)
+        # Días que no existen en el mes del resumen (p. ej. 31 en abril) pasan al último día
+        last_day = calendar.monthrange(year, month)[1]
+        for t in adjusted:
+            t.date = datetime.date(year, month, min(t.date.day, last_day))
+        # Resumen y movimientos en un solo commit: si algo falla no queda un resumen vacío
+        db = self._writer_db()
+        with db.batch():
+            sid = db.add_statement(month, year, card_name, '', file_path)
+            if adjusted:
+                db.add_transactions(sid, adjusted)
+        db.analyze_after_import(len(adjusted))
+        return len(adjusted)
+
+    def _poll_load(self, future):
+        if not future.done():
+            self.root.after(100, self._poll_load, future)
+            return
+        self.btn_load.config(state='normal')
+        self.progress.stop(); self.progress.grid_remove()
         try:
-            sid = self.db.add_statement(month, year, cn.strip(), '', file_path)
+            count = future.result()
         except ValueError as e:
+            # resumen duplicado o mes inválido
             messagebox.showerror('Error', str(e))
             return
-
-        try:
-            txs = self.parser.parse_pdf(file_path)
         except Exception as e:
-            messagebox.showerror('Error', f'No se pudo analizar el PDF: {e}')
+            messagebox.showerror('Error', f'No se pudo cargar el PDF: {e}')
             return
 
-        adjusted = []
-        for t in txs:
-            try:
-                nd = datetime.date(year, month, t.date.day)
-                adjusted.append(t.__class__(date=nd, store_name=t.store_name, amount=t.amount, installment_number=t.installment_number))
-            except:
-                continue
+        self._schedule_refresh()
+        self._sums_cache.pop(None, None)
 
-        if not adjusted:
+        if not count:
             messagebox.showwarning('Sin datos','No se encontraron transacciones en el PDF')
         else:
-            self.db.add_transactions(sid, adjusted)
-            messagebox.showinfo('Éxito', f'Se cargaron {len(adjusted)} transacciones')
-
-        self.refresh_statements()
+            messagebox.showinfo('Éxito', f'Se cargaron {count} transacciones')
 
     def modify_statement_ui(self):
         sel = self.tree_statements.selection()
         if not sel:
             messagebox.showinfo('Modificar resumen','Seleccione un resumen para modificar')
             return
-        sid = int(sel[0])
+        sid = self._iid_to_sid[sel[0]]
         # obtener valores actuales
-        current = next((row for row in self.db.get_statements() if row[0]==sid), None)
+        current = self._statements_by_id.get(sid)
         if not current: return
-        _, month, year, card_name, _ = current
+        month, year, card_name = current['month'], current['year'], current['card_name']
 
         ms = simpledialog.askstring('Mes','Ingrese el mes (1-12)', initialvalue=str(month))
         if not ms: return
@@ -282,12 +472,9 @@ class ExpenseApp:
             return
 
         try:
-            c = self.db.conn.cursor()
-            c.execute('UPDATE statements SET month=?, year=?, card_name=? WHERE id=?',
-                      (new_month, new_year, cn.strip(), sid))
-            self.db.conn.commit()
+            self.db.update_statement(sid, new_month, new_year, cn.strip())
+            self._schedule_refresh()
             messagebox.showinfo('Modificar resumen','Resumen modificado correctamente')
-            self.refresh_statements()
         except Exception as e:
             messagebox.showerror('Error', str(e))
 
@@ -306,15 +493,14 @@ class ExpenseApp:
         dlg.rowconfigure(0, weight=1); dlg.columnconfigure(1, weight=1)
 
         def refresh_list():
-            for i in tree.get_children(): tree.delete(i)
-            for cid, n in self.db.get_categories():
-                tree.insert('', 'end', iid=str(cid), values=(n,))
+            self._fill_tree(tree, ((str(cid), (n,)) for cid, n in self._get_categories()[0]))
 
         def add_cat():
             n = simpledialog.askstring('Nueva Categoría','Ingrese el nombre')
             if n:
                 try:
                     self.db.add_category(n.strip())
+                    self._categories = None
                     refresh_list()
                 except ValueError as e:
                     messagebox.showerror('Error', str(e))
@@ -325,6 +511,10 @@ class ExpenseApp:
                 if messagebox.askyesno('Confirmar','¿Eliminar categoría?'):
                     try:
                         self.db.delete_category(int(sel[0]))
+                        self._drop_txn_pool()
+                        sel_stmt = self.tree_statements.selection()
+                        if sel_stmt: self.display_transactions(self._iid_to_sid[sel_stmt[0]])
+                        self._categories = None
                         refresh_list()
                     except ValueError as e:
                         messagebox.showerror('Error', str(e))
@@ -338,39 +528,69 @@ class ExpenseApp:
         if not sel:
             messagebox.showinfo('Eliminar resumen','Seleccione un resumen para eliminar')
             return
-        sid = int(sel[0])
+        sid = self._iid_to_sid[sel[0]]
         if not messagebox.askyesno('Confirmar','¿Eliminar resumen y transacciones?'): return
-        self.db.conn.execute('DELETE FROM statements WHERE id=?', (sid,))
-        self.db.conn.commit()
-        self.refresh_statements()
-        self.tree_transactions.delete(*self.tree_transactions.get_children())
-        self.ax.clear(); self.ax.text(0.5,0.5,'Sin datos',ha='center',va='center'); self.canvas.draw()
+        self.db.delete_statement(sid)
+        self._schedule_refresh()
+        self._drop_txn_pool(sid)
+        shown = self.tree_transactions.get_children()
+        if shown:
+            self.tree_transactions.detach(*shown)
+        self._pie_data = None
+        self._draw_pie()
+        self._last_chart_key = None
         self.lbl_total.config(text=''); self.lbl_cat_tot.config(text='')
 
     def export_all_to_excel(self):
-        query = (
-            "SELECT stm.year AS Año, stm.month AS Mes, stm.card_name AS Tarjeta, "
-            "t.date AS Fecha, s.name AS Comercio, t.amount AS Monto, c.name AS Categoría "
-            "FROM transactions t "
-            "JOIN statements stm ON t.statement_id=stm.id "
-            "JOIN stores s ON t.store_id=s.id "
-            "JOIN categories c ON s.category_id=c.id "
-            "ORDER BY stm.year DESC, stm.month DESC, stm.card_name, t.date"
-        )
-        df = pd.read_sql_query(query, self.db.conn)
-        path = filedialog.asksaveasfilename(defaultextension='.xlsx', filetypes=[('Excel','*.xlsx')])
+        path = filedialog.asksaveasfilename(defaultextension='.xlsx',
+                                            filetypes=[('Excel','*.xlsx'), ('Parquet','*.parquet')])
         if not path: return
         try:
-            df.to_excel(path, index=False, sheet_name='Gastos')
-            messagebox.showinfo('Excel','Reporte guardado en ' + path)
+            cur = self.db.get_export_rows()
+            if path.lower().endswith('.parquet'):
+                self._write_parquet(cur, path)
+            else:
+                self._write_xlsx(cur, path)
+            messagebox.showinfo('Exportar','Reporte guardado en ' + path)
         except Exception as e:
             messagebox.showerror('Error', str(e))
 
+    def _write_xlsx(self, cur, path):
+        import xlsxwriter
+        # Filas del cursor directo a la hoja; constant_memory vuelca cada fila a disco
+        with xlsxwriter.Workbook(path, {'constant_memory': True}) as wb:
+            ws = wb.add_worksheet('Gastos')
+            ws.write_row(0, 0, [d[0] for d in cur.description])
+            for i, row in enumerate(cur, 1):
+                ws.write_row(i, 0, row)
+
+    def _write_parquet(self, cur, path):
+        # pyarrow es opcional: sólo se necesita para exportar en Parquet
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('Para exportar en Parquet instale pyarrow (pip install pyarrow)') from None
+        types = (pa.int64(), pa.int64(), pa.string(), pa.string(), pa.string(), pa.float64(), pa.string())
+        schema = pa.schema(list(zip((d[0] for d in cur.description), types)))
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            while True:
+                rows = cur.fetchmany(PARQUET_BATCH_ROWS)
+                if not rows: break
+                cols = [pa.array(col, type=f.type) for col, f in zip(zip(*rows), schema)]
+                writer.write_batch(pa.RecordBatch.from_arrays(cols, schema=schema))
+
     def on_toggle_mode(self):
         self.on_statement_select(None)
 
     def run(self):
         self.root.mainloop()
+        # Se descartan las importaciones pendientes y se espera la que esté en curso:
+        # recién entonces nadie más usa las conexiones de los hilos de trabajo
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for db in self._worker_dbs:
+            db.close()
+        self.db.close()
 
 if __name__ == '__main__':
     ExpenseApp().run()
@@ -2,19 +2,97 @@
 
 import sqlite3
 import datetime
-from typing import List, Tuple
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Tuple
 from transaction import Transaction
 
+# Importaciones a partir de este tamaño refrescan las estadísticas del planificador
+ANALYZE_MIN_ROWS = 1000
+
 class DatabaseManager:
-    def __init__(self, db_path: str = 'expenses.db') -> None:
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute('PRAGMA foreign_keys=ON;')
+    TXNS_BY_STATEMENT_SQL = (
+        "SELECT t.id AS id,strftime('%d/%m/%Y',t.date) AS fecha,s.name AS store,t.amount AS amount,"
+        "t.installment_number AS installment,s.id AS store_id,c.id AS category_id,COALESCE(c.name,?) AS category "
+        "FROM transactions t JOIN stores s ON t.store_id=s.id "
+        "LEFT JOIN categories c ON s.category_id=c.id "
+        "WHERE t.statement_id=? ORDER BY t.date ASC"
+    )
+    BREAKDOWN_BY_STATEMENT_SQL = (
+        "SELECT c.name,SUM(t.amount),SUM(SUM(t.amount)) OVER (),"
+        "SUM(t.amount)>0 AND UPPER(c.name)!='NO APLICA' FROM transactions t "
+        "JOIN stores s ON t.store_id=s.id "
+        "JOIN categories c ON s.category_id=c.id "
+        "WHERE t.statement_id=? "
+        "GROUP BY c.id ORDER BY SUM(t.amount) DESC"
+    )
+    BREAKDOWN_ALL_SQL = (
+        "SELECT c.name,ct.total,SUM(ct.total) OVER (),"
+        "ct.total>0 AND UPPER(c.name)!='NO APLICA' FROM category_totals ct "
+        "JOIN categories c ON ct.category_id=c.id "
+        "WHERE ct.n>0 ORDER BY ct.total DESC"
+    )
+    # Las filas a importar pasan por _incoming y SQLite resuelve los comercios en el JOIN
+    INCOMING_SQL = "INSERT INTO _incoming(date,store_name,amount,installment) VALUES(?,?,?,?)"
+    INCOMING_STORES_SQL = (
+        "INSERT OR IGNORE INTO stores(name,category_id) "
+        "SELECT DISTINCT store_name,? FROM _incoming"
+    )
+    INCOMING_TXNS_SQL = (
+        "INSERT INTO transactions(statement_id,date,store_id,amount,installment_number) "
+        "SELECT ?,i.date,s.id,i.amount,i.installment FROM _incoming i "
+        "JOIN stores s ON s.name=i.store_name ORDER BY i.rowid"
+    )
+    EXPORT_SQL = (
+        "SELECT stm.year AS Año, stm.month AS Mes, stm.card_name AS Tarjeta, "
+        "t.date AS Fecha, s.name AS Comercio, t.amount AS Monto, c.name AS Categoría "
+        "FROM transactions t "
+        "JOIN statements stm ON t.statement_id=stm.id "
+        "JOIN stores s ON t.store_id=s.id "
+        "JOIN categories c ON s.category_id=c.id "
+        "ORDER BY stm.year DESC, stm.month DESC, stm.card_name, t.date"
+    )
+
+    def __init__(self, db_path: str = 'expenses.db', check_same_thread: bool = True) -> None:
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, cached_statements=256, check_same_thread=check_same_thread)
+        self.conn.row_factory = sqlite3.Row
+        self._batch_depth = 0
+        # WAL deja junto a la base los archivos expenses.db-wal y expenses.db-shm
+        self.conn.executescript("""
+            PRAGMA foreign_keys=ON;
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+            PRAGMA mmap_size=268435456;
+        """)
         self._create_tables()
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS _incoming("
+            "date TEXT, store_name TEXT, amount REAL, installment INTEGER)"
+        )
         self._ensure_default_category()
         self._ensure_cash_statement()
+        self._txn_cursor = self.conn.cursor()
+        self._cur = self.conn.cursor()
+        # Ambos ids son fijos durante la ejecución (la categoría por defecto no se puede borrar)
+        self._default_cid = self.conn.execute(
+            "SELECT id FROM categories WHERE name=?", ("NO ASIGNADA",)
+        ).fetchone()[0]
+        self._cash_sid = self.conn.execute(
+            "SELECT id FROM statements WHERE year=? AND month=? AND card_name=? AND last4digits=?",
+            (1900, 1, "EFECTIVO", "")
+        ).fetchone()[0]
+        self.conn.execute("PRAGMA optimize")
+
+    def close(self) -> None:
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
 
     def _create_tables(self) -> None:
         c = self.conn.cursor()
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='category_totals'")
+        backfill_totals = c.fetchone() is None
         c.executescript("""
             CREATE TABLE IF NOT EXISTS categories(
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,15 +123,73 @@ class DatabaseManager:
                 FOREIGN KEY(statement_id) REFERENCES statements(id) ON DELETE CASCADE,
                 FOREIGN KEY(store_id) REFERENCES stores(id)
             );
+            -- (statement_id, store_id, amount) cubre las sumas por categoría de un resumen
+            CREATE INDEX IF NOT EXISTS idx_tx_stmt ON transactions(statement_id, store_id, amount);
+            -- Lista de movimientos de un resumen ya ordenada por fecha, sin ordenar en memoria
+            CREATE INDEX IF NOT EXISTS idx_tx_stmt_date ON transactions(statement_id, date);
+            CREATE INDEX IF NOT EXISTS idx_tx_store ON transactions(store_id);
+            CREATE INDEX IF NOT EXISTS idx_stores_cat ON stores(category_id);
+            -- Orden de la lista de resúmenes y del export sin ordenar en memoria
+            CREATE INDEX IF NOT EXISTS idx_stmt_order ON statements(year DESC, month DESC, card_name);
+
+            -- Totales por categoría de todo el historial, mantenidos por triggers
+            CREATE TABLE IF NOT EXISTS category_totals(
+                category_id INTEGER PRIMARY KEY,
+                total REAL NOT NULL DEFAULT 0,
+                n INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TRIGGER IF NOT EXISTS trg_tx_ins AFTER INSERT ON transactions BEGIN
+                INSERT INTO category_totals(category_id,total,n)
+                    SELECT category_id, NEW.amount, 1 FROM stores
+                    WHERE id=NEW.store_id AND category_id IS NOT NULL
+                    ON CONFLICT(category_id) DO UPDATE SET total=total+excluded.total, n=n+1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_tx_del AFTER DELETE ON transactions BEGIN
+                UPDATE category_totals SET total=total-OLD.amount, n=n-1
+                    WHERE category_id=(SELECT category_id FROM stores WHERE id=OLD.store_id);
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_tx_upd AFTER UPDATE OF store_id, amount ON transactions BEGIN
+                UPDATE category_totals SET total=total-OLD.amount, n=n-1
+                    WHERE category_id=(SELECT category_id FROM stores WHERE id=OLD.store_id);
+                INSERT INTO category_totals(category_id,total,n)
+                    SELECT category_id, NEW.amount, 1 FROM stores
+                    WHERE id=NEW.store_id AND category_id IS NOT NULL
+                    ON CONFLICT(category_id) DO UPDATE SET total=total+excluded.total, n=n+1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_store_cat_out AFTER UPDATE OF category_id ON stores
+            WHEN OLD.category_id IS NOT NEW.category_id BEGIN
+                UPDATE category_totals
+                    SET total=total-(SELECT COALESCE(SUM(amount),0) FROM transactions WHERE store_id=NEW.id),
+                        n=n-(SELECT COUNT(*) FROM transactions WHERE store_id=NEW.id)
+                    WHERE category_id=OLD.category_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_store_cat_in AFTER UPDATE OF category_id ON stores
+            WHEN OLD.category_id IS NOT NEW.category_id AND NEW.category_id IS NOT NULL BEGIN
+                INSERT INTO category_totals(category_id,total,n)
+                    SELECT NEW.category_id, COALESCE(SUM(amount),0), COUNT(*) FROM transactions
+                    WHERE store_id=NEW.id
+                    ON CONFLICT(category_id) DO UPDATE SET total=total+excluded.total, n=n+excluded.n;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_cat_del AFTER DELETE ON categories BEGIN
+                DELETE FROM category_totals WHERE category_id=OLD.id;
+            END;
         """)
-        self.conn.commit()
+        # executescript ya confirmó el DDL; sólo el backfill necesita transacción
+        if backfill_totals:
+            with self.batch():
+                c.execute(
+                    "INSERT INTO category_totals(category_id,total,n) "
+                    "SELECT s.category_id,SUM(t.amount),COUNT(*) FROM transactions t "
+                    "JOIN stores s ON t.store_id=s.id WHERE s.category_id IS NOT NULL "
+                    "GROUP BY s.category_id"
+                )
 
     def _ensure_default_category(self) -> None:
         c = self.conn.cursor()
         c.execute("SELECT 1 FROM categories WHERE name=?", ("NO ASIGNADA",))
         if not c.fetchone():
-            c.execute("INSERT INTO categories(name) VALUES(?)", ("NO ASIGNADA",))
-            self.conn.commit()
+            with self.batch():
+                c.execute("INSERT INTO categories(name) VALUES(?)", ("NO ASIGNADA",))
 
     def _ensure_cash_statement(self) -> None:
         c = self.conn.cursor()
@@ -62,42 +198,51 @@ class DatabaseManager:
             (1900, 1, "EFECTIVO", "")
         )
         if not c.fetchone():
-            c.execute(
-                "INSERT INTO statements(month,year,card_name,last4digits,file_path) VALUES(?,?,?,?,NULL)",
-                (1, 1900, "EFECTIVO", "")
-            )
-            self.conn.commit()
+            with self.batch():
+                c.execute(
+                    "INSERT INTO statements(month,year,card_name,last4digits,file_path) VALUES(?,?,?,?,NULL)",
+                    (1, 1900, "EFECTIVO", "")
+                )
+
+    @contextmanager
+    def batch(self) -> Iterator[sqlite3.Connection]:
+        # Anidable: sólo el bloque más externo confirma (o revierte) la transacción,
+        # así varias operaciones públicas pueden quedar en un único commit
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self.conn
+            finally:
+                self._batch_depth -= 1
+            return
+        self._batch_depth = 1
+        try:
+            with self.conn:
+                yield self.conn
+        finally:
+            self._batch_depth = 0
 
     def get_cash_statement_id(self) -> int:
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT id FROM statements WHERE year=? AND month=? AND card_name=? AND last4digits=?",
-            (1900, 1, "EFECTIVO", "")
-        )
-        return c.fetchone()[0]
+        return self._cash_sid
 
     def get_default_category_id(self) -> int:
-        c = self.conn.cursor()
-        c.execute("SELECT id FROM categories WHERE name=?", ("NO ASIGNADA",))
-        return c.fetchone()[0]
+        return self._default_cid
 
     # Category operations
     def add_category(self, name: str) -> None:
-        c = self.conn.cursor()
         try:
-            c.execute("INSERT INTO categories(name) VALUES(?)", (name,))
-            self.conn.commit()
+            with self.batch():
+                self.conn.execute("INSERT INTO categories(name) VALUES(?)", (name,))
         except sqlite3.IntegrityError:
             raise ValueError(f"La categoría '{name}' ya existe.")
 
     def delete_category(self, cid: int) -> None:
-        default = self.get_default_category_id()
+        default = self._default_cid
         if cid == default:
             raise ValueError("No se puede eliminar la categoría por defecto.")
-        c = self.conn.cursor()
-        c.execute("UPDATE stores SET category_id=? WHERE category_id=?", (default, cid))
-        c.execute("DELETE FROM categories WHERE id=?", (cid,))
-        self.conn.commit()
+        with self.batch():
+            self.conn.execute("UPDATE stores SET category_id=? WHERE category_id=?", (default, cid))
+            self.conn.execute("DELETE FROM categories WHERE id=?", (cid,))
 
     def get_categories(self) -> List[Tuple[int, str]]:
         c = self.conn.cursor()
@@ -105,99 +250,85 @@ class DatabaseManager:
         return c.fetchall()
 
     # Store operations
-    def get_store_id(self, name: str) -> int:
-        c = self.conn.cursor()
-        c.execute("SELECT id FROM stores WHERE name=?", (name,))
-        row = c.fetchone()
-        if row:
-            return row[0]
-        default = self.get_default_category_id()
-        c.execute("INSERT INTO stores(name,category_id) VALUES(?,?)", (name, default))
-        self.conn.commit()
-        return c.lastrowid
-
     def update_store_category(self, sid: int, cid: int) -> None:
-        c = self.conn.cursor()
-        c.execute("UPDATE stores SET category_id=? WHERE id=?", (cid, sid))
-        self.conn.commit()
-
-    def get_store_category(self, sid: int) -> Tuple[int, str]:
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT c.id,c.name FROM stores s JOIN categories c ON s.category_id=c.id WHERE s.id=?",
-            (sid,)
-        )
-        return c.fetchone() or (self.get_default_category_id(), "NO ASIGNADA")
+        with self.batch():
+            self.conn.execute("UPDATE stores SET category_id=? WHERE id=?", (cid, sid))
 
     # Statement operations
     def add_statement(self, month: int, year: int, card_name: str, last4digits: str, file_path: str) -> int:
         c = self.conn.cursor()
         try:
-            c.execute(
-                "INSERT INTO statements(month,year,card_name,last4digits,file_path) VALUES(?,?,?,?,?)",
-                (month, year, card_name, last4digits, file_path)
-            )
-            self.conn.commit()
+            with self.batch():
+                c.execute(
+                    "INSERT INTO statements(month,year,card_name,last4digits,file_path) VALUES(?,?,?,?,?)",
+                    (month, year, card_name, last4digits, file_path)
+                )
             return c.lastrowid
         except sqlite3.IntegrityError:
             raise ValueError(f"Resumen ya existe para {month}/{year} de {card_name}.")
 
-    def get_statements(self) -> List[Tuple[int, int, int, str, str]]:
+    def update_statement(self, sid: int, month: int, year: int, card_name: str) -> None:
+        try:
+            with self.batch():
+                self.conn.execute(
+                    "UPDATE statements SET month=?, year=?, card_name=? WHERE id=?",
+                    (month, year, card_name, sid)
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Resumen ya existe para {month}/{year} de {card_name}.")
+
+    def delete_statement(self, sid: int) -> None:
+        # ON DELETE CASCADE borra sus transacciones dentro de la misma transacción
+        with self.batch():
+            self.conn.execute("DELETE FROM statements WHERE id=?", (sid,))
+
+    def get_statements(self) -> List[Tuple[int, int, int, str]]:
+        # Sólo las columnas que muestra la lista: idx_stmt_order la cubre entera
         c = self.conn.cursor()
         c.execute(
-            "SELECT id, month, year, card_name, last4digits FROM statements "
+            "SELECT id, month, year, card_name FROM statements "
             "ORDER BY year DESC, month DESC, card_name"
         )
         return c.fetchall()
 
     # Transaction operations
+    def _insert_incoming(self, sid: int, rows: Iterable[Tuple[str, str, float, Optional[int]]]) -> None:
+        # Una transacción: carga _incoming, crea los comercios nuevos e inserta
+        # los movimientos con sus store_id en el mismo INSERT ... SELECT
+        with self.batch():
+            self.conn.executemany(self.INCOMING_SQL, rows)
+            self.conn.execute(self.INCOMING_STORES_SQL, (self._default_cid,))
+            self.conn.execute(self.INCOMING_TXNS_SQL, (sid,))
+            self.conn.execute("DELETE FROM _incoming")
+
     def add_transactions(self, sid: int, txs: List[Transaction]) -> None:
-        c = self.conn.cursor()
-        for t in txs:
-            store_id = self.get_store_id(t.store_name)
-            c.execute(
-                "INSERT INTO transactions(statement_id,date,store_id,amount,installment_number) "
-                "VALUES(?,?,?,?,?)",
-                (sid, t.date.isoformat(), store_id, t.amount, t.installment_number)
-            )
-        self.conn.commit()
-
-    def get_transactions_by_statement(self, sid: int) -> List[Tuple[int, str, str, float, int, int]]:
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT t.id,t.date,s.name,t.amount,t.installment_number,s.id "
-            "FROM transactions t JOIN stores s ON t.store_id=s.id "
-            "WHERE t.statement_id=? ORDER BY t.date ASC", (sid,)
-        )
-        return c.fetchall()
+        self._insert_incoming(sid, ((t.date.isoformat(), t.store_name, t.amount, t.installment_number) for t in txs))
 
-    def get_category_sums(self, sid: int) -> List[Tuple[str, float]]:
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT c.name,SUM(t.amount) FROM transactions t "
-            "JOIN stores s ON t.store_id=s.id "
-            "JOIN categories c ON s.category_id=c.id "
-            "WHERE t.statement_id=? "
-            "GROUP BY c.id ORDER BY SUM(t.amount) DESC", (sid,)
-        )
-        return c.fetchall()
+    def analyze_after_import(self, count: int) -> None:
+        # Llamar una vez confirmado el batch: ANALYZE no debe alargar la transacción de la importación
+        if count >= ANALYZE_MIN_ROWS:
+            self.conn.execute("ANALYZE transactions")
 
-    def get_all_category_sums(self) -> List[Tuple[str, float]]:
-        c = self.conn.cursor()
-        c.execute(
-            "SELECT c.name,SUM(t.amount) FROM transactions t "
-            "JOIN stores s ON t.store_id=s.id "
-            "JOIN categories c ON s.category_id=c.id "
-            "GROUP BY c.id ORDER BY SUM(t.amount) DESC"
-        )
-        return c.fetchall()
+    def get_transactions_by_statement(self, sid: int) -> sqlite3.Cursor:
+        # Cursor reutilizado: el resultado debe consumirse antes de la siguiente llamada
+        return self._txn_cursor.execute(self.TXNS_BY_STATEMENT_SQL, ("NO ASIGNADA", sid))
+
+    def get_export_rows(self) -> sqlite3.Cursor:
+        # Cursor propio: el export lo recorre completo mientras escribe el archivo
+        return self.conn.execute(self.EXPORT_SQL)
+
+    def get_category_breakdown(self, sid: Optional[int] = None) -> List[Tuple[str, float, float, int]]:
+        # (categoría, subtotal, total general, va al gráfico); sid=None agrega todos los resúmenes
+        if sid is None:
+            return self._cur.execute(self.BREAKDOWN_ALL_SQL).fetchall()
+        return self._cur.execute(self.BREAKDOWN_BY_STATEMENT_SQL, (sid,)).fetchall()
+
+    def delete_transaction(self, tid: int) -> None:
+        with self.batch():
+            self.conn.execute("DELETE FROM transactions WHERE id=?", (tid,))
 
     def add_manual_transaction(self, sid: int, date: datetime.date, name: str, amt: float) -> None:
-        c = self.conn.cursor()
-        store_id = self.get_store_id(name)
-        c.execute(
-            "INSERT INTO transactions(statement_id,date,store_id,amount,installment_number) "
-            "VALUES(?,?,?,?,NULL)",
-            (sid, date.isoformat(), store_id, amt)
-        )
-        self.conn.commit()
+        self.add_manual_transactions(sid, [(date, name, amt)])
+
+    def add_manual_transactions(self, sid: int, rows: List[Tuple[datetime.date, str, float]]) -> None:
+        self._insert_incoming(sid, ((date.isoformat(), name, amt, None) for date, name, amt in rows))
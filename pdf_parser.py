@@ -2,79 +2,109 @@
 
 import re
 import datetime
-from typing import List
+from typing import List, Optional
 import fitz  # PyMuPDF
 from transaction import Transaction
 
+# Los avisos de MuPDF sobre PDFs mal formados sólo ensucian la consola de la app
+fitz.TOOLS.mupdf_display_errors(False)
+
 class PDFParser:
-    DATE_PATTERN = re.compile(r"^(\d{1,2}[/-]\d{1,2})")
-    MONTH_PATTERN = re.compile(r"^(\d{1,2})\s+([A-Za-zÁÉÍÓÚáéíóúÜü\.]+)")
-    AMOUNT_PATTERN = re.compile(r"\d[\d\.]*,\d{2}-?")
-    INSTALL_PATTERN = re.compile(r"C\.?\s*(\d{1,2})/(\d{1,2})", re.IGNORECASE)
     MONTH_NAMES = {
         'ene':1,'feb':2,'mar':3,'abr':4,'may':5,'jun':6,
         'jul':7,'ago':8,'sep':9,'oct':10,'nov':11,'dic':12
     }
+    # Una sola regex por página: sólo las líneas que empiezan con fecha
+    # (dd/mm, dd-mm o "dd mes") llegan al bucle de Python. La palabra del mes
+    # debe empezar con una abreviatura de MONTH_NAMES; la "a" limita el plegado
+    # de mayúsculas a ASCII ("ſep" no debe coincidir con "sep").
+    LINE_PATTERN = re.compile(
+        r"^[^\S\n]*(?:(?P<num>\d{1,2}[/-]\d{1,2})"
+        r"|(?P<day>\d{1,2})[^\S\n]+(?P<mon>(?ai:" + "|".join(MONTH_NAMES) + r")[A-Za-zÁÉÍÓÚáéíóúÜü\.]*))"
+        r"(?P<rest>[^\n]*)", re.MULTILINE)
+    AMOUNT_PATTERN = re.compile(r"\d[\d\.]*,\d{2}-?")
+    # AMOUNT_PATTERN invertido, para la línea invertida: si el monto cierra la línea
+    # (caso común) se encuentra con un match anclado en vez de recorrerla entera.
+    # El lookahead garantiza el mismo resultado que el último match de finditer.
+    REV_AMOUNT_PATTERN = re.compile(r"-?\d{2},[\d\.]*\d(?![\d\.,])")
+    # "1.234,56" -> "1234.56": quita los separadores de miles, la coma pasa a punto decimal
+    AMOUNT_TRANS = str.maketrans({'.': None, ',': '.'})
+    INSTALL_PATTERN = re.compile(r"C\.?\s*(\d{1,2})/(\d{1,2})", re.IGNORECASE)
+    # Sin TEXT_PRESERVE_IMAGES MuPDF no arma los bloques de imagen (no traen movimientos)
+    BLOCK_FLAGS = fitz.TEXTFLAGS_BLOCKS & ~fitz.TEXT_PRESERVE_IMAGES
 
     def parse_pdf(self, pdf_path: str) -> List[Transaction]:
-        doc = fitz.open(pdf_path)
-        lines: List[str] = []
-        for page in doc:
-            lines.extend(page.get_text("text").split("\n"))
-        doc.close()
+        # Un solo read() del archivo; MuPDF trabaja luego sobre el buffer en memoria
+        with open(pdf_path, 'rb') as f:
+            return self.parse_pdf_bytes(f.read())
 
+    def parse_pdf_bytes(self, data: bytes) -> List[Transaction]:
         transactions: List[Transaction] = []
-        for line in lines:
-            orig = line; line = line.strip()
-            if not line: continue
-            date = None; rest = None
+        year = datetime.date.today().year
+        with fitz.open(stream=data, filetype="pdf") as doc:
+            for page in doc:
+                # sólo bloques de texto (tipo 0)
+                for b in page.get_text("blocks", flags=self.BLOCK_FLAGS):
+                    if b[6] == 0:
+                        transactions.extend(self.parse_text(b[4], year))
+        return transactions
 
-            m = self.DATE_PATTERN.match(line)
-            if m:
-                part = m.group(1)
+    def parse_text(self, text: str, year: Optional[int] = None) -> List[Transaction]:
+        # El año se toma una vez por documento; las fechas del PDF no lo traen
+        if year is None:
+            year = datetime.date.today().year
+        date_ = datetime.date
+        month_names = self.MONTH_NAMES
+        transactions: List[Transaction] = []
+        for m in self.LINE_PATTERN.finditer(text):
+            date = None
+            part = m.group('num')
+            if part:
                 try:
                     d, mn = map(int, part.replace('-', '/').split('/'))
-                    date = datetime.date(datetime.date.today().year, mn, d)
-                    rest = line[m.end():].strip()
-                except:
+                    date = date_(year, mn, d)
+                except ValueError:
+                    pass
+            else:
+                mn = month_names[m.group('mon')[:3].lower()]
+                try:
+                    date = date_(year, mn, int(m.group('day')))
+                except ValueError:
                     pass
 
-            if date is None:
-                m2 = self.MONTH_PATTERN.match(line)
-                if m2:
-                    d = int(m2.group(1))
-                    mn = self.MONTH_NAMES.get(m2.group(2).lower()[:3])
-                    if mn:
-                        date = datetime.date(datetime.date.today().year, mn, d)
-                        rest = line[m2.end():].strip()
-
+            rest = m.group('rest').strip()
             if date is None or not rest:
                 continue
 
-            amt_m = None
-            for am in self.AMOUNT_PATTERN.finditer(rest):
-                amt_m = am
-            if not amt_m:
-                continue
-
-            amt_str = amt_m.group(0)
-            neg = '-' in amt_str or (amt_m.start() > 0 and rest[amt_m.start()-1] == '-')
-            clean = amt_str.replace('.', '').replace(',', '.')
-            try:
-                amt = float(clean)
-                if neg: amt = -amt
-            except:
+            rm = self.REV_AMOUNT_PATTERN.match(rest[::-1])
+            if rm:
+                start = len(rest) - rm.end()
+                amt_str = rest[start:]
+            else:
+                amt_m = None
+                for am in self.AMOUNT_PATTERN.finditer(rest):
+                    amt_m = am
+                if not amt_m:
+                    continue
+                start = amt_m.start()
+                amt_str = amt_m.group(0)
+            # Los montos con "-" final (pagos, créditos) no se importan
+            if amt_str[-1] == '-':
                 continue
+            # AMOUNT_PATTERN garantiza dígitos y una coma
+            amt = float(amt_str.translate(self.AMOUNT_TRANS))
+            if start > 0 and rest[start-1] == '-': amt = -amt
 
-            desc = rest[:amt_m.start()].strip()
+            desc = rest[:start].strip()
             inst = None
-            im = self.INSTALL_PATTERN.search(desc)
+            # toda cuota lleva "/": sin ella se evita la regex (el caso común)
+            im = '/' in desc and self.INSTALL_PATTERN.search(desc)
             if im:
                 inst = int(im.group(1))
                 desc = desc[:im.start()].strip()
             if '*' in desc:
                 desc = desc.split('*',1)[1].strip()
 
-            transactions.append(Transaction(date=date, store_name=desc or orig, amount=amt, installment_number=inst))
+            transactions.append(Transaction(date=date, store_name=desc or m.group(0), amount=amt, installment_number=inst))
 
         return transactions
@@ -4,7 +4,7 @@ from dataclasses import dataclass
 from typing import Optional
 import datetime
 
-@dataclass
+@dataclass(slots=True)
 class Transaction:
     date: datetime.date
     store_name: str